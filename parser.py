@@ -1,15 +1,20 @@
-import xml.etree.ElementTree as ET
+try:
+    import lxml.etree as ET  # type: ignore[import-untyped]
+except ImportError:
+    import xml.etree.ElementTree as ET
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+from collections import ChainMap, deque
+from copy import deepcopy
+import argparse
+import ast
 import json
+import operator
+import re
 import sys
-
-#fname = "examples/3.0/adder"
-#fname = "examples/custom/hadamard_cnot"
-
-#tree = ET.parse(f'{fname}.qasm.xml')
-#print(sys.argv[1].replace("\\","/"))
-tree = ET.parse(sys.argv[1].replace("\\","/"))
-# tree = ET.parse('examples/3.0/teleport.qasm.xml')
-root = tree.getroot()
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 ns = "{http://www.srcML.org/srcML/src}"
 unitary_gates = ["U","p","phase","x","y","z","h","s","sdg","t","tdg","sx","rx","ry","rz","id","u1","u2","u3"]
@@ -18,436 +23,625 @@ unitary_control = ["cx","CX","cy","cz","cp","cphase","crx","cry","crz","ch","cu"
 nary_control = ["ccx","cswap"]
 gates = unitary_gates + nary_gates + unitary_control + nary_control
 
+# ElementPath expressions used by the driver loop, built once
+PATH_NAME = f"./{ns}name"
+PATH_EXPR = f"./{ns}expr"
+PATH_BLOCK = f"./{ns}block/{ns}block_content"
+PATH_DECL_LET = f"./{ns}decl/{ns}specifier[.='let']"
+PATH_DECL_NAME = f"./{ns}decl/{ns}name"
+PATH_DECL_TYPE = f"./{ns}decl/{ns}type"
+PATH_DECL_TYPE_NAME = f"./{ns}decl/{ns}type/{ns}name"
+PATH_DECL_INIT = f"./{ns}decl/{ns}init/{ns}expr"
+PATH_ANY_CALL = f".//{ns}call"
+PATH_MEASURE_OP = f".//{ns}operator[.='measure']"
+PATH_QARGS = f"./{ns}argument_list[@type='quantum']/{ns}argument"
+PATH_ARGS = f".//{ns}argument_list/{ns}argument"
+PATH_MODIFIERS = f"./{ns}modifier"
+PATH_MODIFIER_CALL = f"./{ns}expr/{ns}call"
+PATH_MODIFIER_CALL_NAME = f"./{ns}expr/{ns}call/{ns}name"
+PATH_MODIFIER_CALL_ARG = f"./{ns}expr/{ns}call//{ns}argument"
+PATH_MODIFIER_NAME = f"./{ns}expr/{ns}name"
+PATH_QPARAMS = f"./{ns}parameter_list[@type='quantum']/{ns}parameter"
+PATH_PARAMS = f"./{ns}parameter_list/{ns}parameter"
+PATH_IF = f"./{ns}if"
+PATH_CONDITION = f"./{ns}condition/{ns}expr"
+PATH_LOOP_VAR = f"./{ns}control/{ns}init/{ns}decl/{ns}name"
+PATH_LOOP_RANGE = f"./{ns}control/{ns}range/{ns}expr/{ns}index/{ns}expr"
+PATH_ANY_INDEX = f".//{ns}index"
+PATH_RANGE_OP = f".//{ns}index/{ns}expr/{ns}operator[.=':']"
+PATH_QARG_NAMED = f".//{ns}argument_list[@type='quantum']/{ns}argument/{ns}expr[{ns}name='%s']"
+PATH_EXPR_NAMED = f".//{ns}expr[{ns}name='%s']"
+
 class InvalidQubitArgumentError(Exception):
     """Raised when a qubit argument has yet to be declared"""
-    def __init__(self, qubit_name):
+    def __init__(self, qubit_name: str) -> None:
         super().__init__(f"Qubit '{qubit_name}' has not been declared at this point")
 class ArraySizeMismatchError(Exception):
     """Raised when two or more arrays have mismatching sizes"""
-    def __init__(self, array_name_1, array_name_2):
+    def __init__(self, array_name_1: str, array_name_2: str) -> None:
         super().__init__(f"Arrays '{array_name_1}' and '{array_name_2}' do not match in size")
 
 class Counter:
-    def __init__(self):
+    def __init__(self) -> None:
         self.count = 0
-    def t(self):
+    def t(self) -> int:
         self.count += 1
         return self.count - 1
 
-# XML elements of functions or gates
-scripts = {}
-
-# Stack of maps used to map parameter names to argument names in gates and functions
-maps = [{}]
-
-# Globals used in QASM code occasionally
-globals = {"pi":3.14159,"π":3.14159}
-def replace_globals(string):
-    #print("IN",string)
-    for operator in ['+','-','*','/','%']:
-        string = string.replace(operator,' '+operator+' ')
-    tokens = string.split(' ')
-    rtn = ""
-    for token in tokens:
-        if token in globals:
-            rtn += str(globals[token])
-        else:
-            rtn += token
-        rtn += ' '
-    #print("OUT",rtn)
-    return rtn.strip()
-
-# Stack of if conditions to add onto actions
-ifs = []
-def get_ifs(i):
-    if len(i) > 0:
-        return {"if":",".join(i)}
-    else:
-        return {}
-
-# Map of qubit names to information on the qubit
-#   {
-#       "type" : The type of qubit this is - can be physical ($1), named (a), array (cin[3])
-#       "index" : The integer index of an array qubit, appears only if the qubit is an array
-#       "map" : The name key of the qubit that this qubit currently maps to
-#       "actions" : A list of gate actions performed on each bit. Each action is a map, which looks like:
-#           {
-#               "action" : The type of action being performed. 
-#           }
-#   }
-qubits = {}
-
-def get_all_ctrls_from_time(time):
-    time_data = {}
-    for qubit in qubits:
-        for action in reversed(qubits[qubit]["actions"]):
-            if action["time"] not in time_data:
-                time_data[action["time"]] = []
-            time_data[action["time"]].append(action | {"qubit":qubit})
-    rtn = []
-    while time >= 0:
-        if time in time_data:
-            for action in reversed(time_data[time]):
-                if action["action"] != 'ctrl':
-                    time = -1
-                    break
-                rtn.append(action["qubit"])
-        time -= 1
-
-    return ",".join(reversed(rtn))
-
-
-
-for i in range(6):
-    qubits[f"${i}"] = {"type":"physical","actions":[]}
-
-
-data_queue = []
-for child in root[0]:
-    data_queue.append(child)
-
-count = Counter()
-t = count.t
-while len(data_queue) > 0:
-    child = data_queue.pop(0)
-    if(type(child) == str):
-        if child == "pop-map-stack":
-            maps.pop(0)
-        if child.startswith("add-if-cond"):
-            ifs.insert(0," ".join(child.split()[1:]))
-        elif child.startswith("pop-if-cond"):
-            ifs.pop(0)
-        continue
-    tag = child.tag.replace(ns,"")
-
-    # Save Script Blocks
-    if tag == "gate" or tag == "function":
-        name = child.find(f"./{ns}name")
-        scripts[name.text] = child
-
-    # New Qubit found, store
-    elif tag == "decl_stmt":
-        if child.find(f"./{ns}decl/{ns}specifier[.='let']") != None:
-            name = "".join(child.find(f"./{ns}decl/{ns}name").itertext())
-            target = "".join(child.find(f"./{ns}decl/{ns}init/{ns}expr").itertext())
-            target_name = target.split("[")[0]
-            start,stop = 0,1
-            if "[" in target:
-                if ':' in target:
-                    start = int(replace_globals(target.split('[')[1].split(':')[0]))
-                    end = int(replace_globals(target.split(']')[0].split(':')[1]))+1
-                else:
-                    start = int(replace_globals(target.split('[')[1].split(']')[0]))
-                    end = start+1
-            i = start
-            while i != end:
-                maps[0][name+f"[{i-start}]"] = target_name+f'[{i}]'
-                i += 1
+# Statements whose elements must outlive their turn in the driver loop
+RETAINED_TAGS = (f"{ns}gate", f"{ns}function")
 
-        else:
-            typ = child.find(f"./{ns}decl/{ns}type/{ns}name")
-            typ = "".join(typ.itertext())
-            if "qubit" in typ:
-                name = child.find(f"./{ns}decl/{ns}name").text
-                if "[" in typ:
-                    amt = int(replace_globals(typ.split("[")[1][:-1]))
-                    for i in range(amt):
-                        qubits[f"{name}[{i}]"] = {"type":"array","index":i,"actions":[]}
-                else:
-                    qubits[name] = {"type":"named","actions":[]}
-            elif "const" in "".join(child.find(f"./{ns}decl/{ns}type").itertext()):
-                name = child.find(f"./{ns}decl/{ns}name").text
-                value = eval(replace_globals("".join(child.find(f"./{ns}decl/{ns}init/{ns}expr").itertext())))
-                globals[name] = value
-                print("|",globals)
-
-
-    # Reset Statement
-    elif tag == "reset":
-        target = "".join(child.find(f"./{ns}expr").itertext())
-        line = int(child.attrib["pos"])
-        _t = t()
-        for qubit in qubits:
-            if qubit.startswith(target):
-                qubits[qubit]["actions"].append({"action":"reset","time":_t,"line":line} | get_ifs(ifs))
-
-    # expr_stmt, check for a call! Will only find the first call if there are multiple
-    elif tag == "expr_stmt":
-        line = int(child.attrib["pos"])
-        call = child.find(f".//{ns}call")
-        if call == None:
-            measure_op = child.find(f".//{ns}operator[.='measure']")
-            if measure_op == None:
-                continue
-            expr = "".join(child.find(f"./{ns}expr").itertext())
-            store = expr.split("=")[0].strip()
-            qubit = expr.split("measure")[1].strip()
-            _t = t()
-            if qubit in qubits:
-                qubits[qubit]["actions"].append({"action":"measure","store":store,"time":_t,"line":line} | get_ifs(ifs))
-            elif qubit+"[0]" in qubits:
-                for q in qubits:
-                    if q.startswith(qubit):
-                        qubits[q]["actions"].append({"action":"measure","store":store,"time":_t,"line":line} | get_ifs(ifs))
-            else:
-                raise InvalidQubitArgumentError(qubit)
-            
-            continue
-        name = call.find(f"./{ns}name").text
-        # Get quantum args
-        qargs = call.findall(f"./{ns}argument_list[@type='quantum']/{ns}argument")
-        qargs = ["".join(x.itertext()) for x in qargs]
-        local_qargs = qargs.copy()
-        qargs = [(maps[0][arg] if arg in maps[0] else arg) for arg in qargs]
-        if len(qargs) == 0:
+def iter_statements(path: str) -> Iterator[Any]:
+    """Yield the statements of the program unit as soon as each one is fully parsed."""
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
             continue
-        # Check if call is on a function or gate
-        if name not in scripts and name not in gates:
-            raise Exception("Cannot find valid call name!")
-        # NAME is a gate!
-        elif name in gates or (name in scripts and scripts[name].tag.endswith("gate")):
-            # Check to ensure qubits exist, and are all single
-            arrays = []
-            size = -1
-            for qarg in qargs:
-                if qarg not in qubits:
-                    if qarg+"[0]" in qubits:
-                        arrays.append(qarg)
-                        if size == -1:
-                            size = sum([(1 if name.startswith(qarg) else 0) for name in qubits])
-                        else:
-                            if size != sum([(1 if name.startswith(qarg) else 0) for name in qubits]):
-                                raise ArraySizeMismatchError(arrays[0],qarg)
-                    else:
-                        raise InvalidQubitArgumentError(qarg)
-            # Duplicate short-hand array calls
-            if len(arrays) != 0:
-                instructions = []
-                for i in range(size):
-                    xml_text = ET.tostring(child,encoding='utf-8')
-                    xml_text = xml_text.decode().replace("ns0:","").replace(":ns0","")
-                    copy = ET.fromstring(xml_text)
-                    for qarg in arrays:
-                        change_nodes = copy.findall(f".//{ns}argument_list[@type='quantum']/{ns}argument/{ns}expr[{ns}name='{qarg}']")
-                        for node in change_nodes:
-                            text = ''.join(node.itertext())
-                            text = text.replace(qarg,qarg+f"[{i}]")
-                            tail = node.tail
-                            node.clear()
-                            node.text = str(text)
-                            node.tail = tail
-                    instructions.append(copy)
-                data_queue = instructions + data_queue
-                continue
-            t_set = False
-            modifiers = call.findall(f"./{ns}modifier")
-            #ctrls = []
-            if len(modifiers) > 0:
-                t_set = True
-                _t = t()
-                for modifier in modifiers:
-                    if modifier.find(f"./{ns}expr/{ns}call") != None:
-                        mname = modifier.find(f"./{ns}expr/{ns}call/{ns}name").text
-                        num = int(replace_globals("".join(modifier.find(f"./{ns}expr/{ns}call//{ns}argument").itertext())))
-                    elif modifier.find(f"./{ns}expr/{ns}name") != None:
-                        mname = modifier.find(f"./{ns}expr/{ns}name").text
-                        num = 1
-                    else:
-                        raise Exception("Weird mofidier")
+        depth -= 1
+        if depth == 2:
+            yield elem
+        elif depth == 1:
+            # Only the first unit under the root holds statements
+            return
+
+
+# Marks expression text that failed to evaluate in ParseState.expr_cache
+_INVALID = object()
+
+# Operators allowed in constant expressions; anything else in the syntax tree is rejected
+BINARY_OPS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+UNARY_OPS: Dict[type, Callable[[Any], Any]] = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# Largest exponent accepted, so a short expression cannot stall the parser
+MAX_EXPONENT = 1024
+
+def eval_constant(node: ast.AST) -> Union[int, float]:
+    """Evaluate a parsed arithmetic expression made only of number constants and operators"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+        left, right = eval_constant(node.left), eval_constant(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > MAX_EXPONENT:
+            raise ValueError(f"Exponent {right} is too large")
+        return BINARY_OPS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+        return UNARY_OPS[type(node.op)](eval_constant(node.operand))
+    raise ValueError(f"Unsupported syntax in constant expression: {type(node).__name__}")
+
+class ParseState:
+    """Driver state for one run: qubit tables, QASM constants and the statement queue"""
+    def __init__(self, verbose: bool) -> None:
+        self.verbose = verbose
+        # Map of qubit names to information on the qubit
+        #   {
+        #       "type" : The type of qubit this is - can be physical ($1), named (a), array (cin[3])
+        #       "index" : The integer index of an array qubit, appears only if the qubit is an array
+        #       "map" : The name key of the qubit that this qubit currently maps to
+        #       "actions" : A list of gate actions performed on each bit. Each action is a map, which looks like:
+        #           {
+        #               "action" : The type of action being performed.
+        #               "time" : The time step of the action, shared by every qubit touched by one statement
+        #               "line" : The source position of the statement (absent on unknown gate calls)
+        #               "type" : The gate name, on gate-call and ctrl-gate-call actions
+        #               "ctrl" : Comma-separated control qubits active at this time, on gate calls
+        #               "local_name" : The name the qubit had inside the gate or function that acted on it
+        #               "with" / "store" / "status" / "if" : Swap partner, measurement target, "unknown" gate marker, active if conditions
+        #           }
+        #   }
+        # Actions stay one dict each: out.json is written in this shape and both qslice.py and
+        # src/qpdg_builder.py read actions back by key.
+        self.qubits: Dict[str, Dict[str, Any]] = {}
+        # Actions emitted at each time step, as (declaration index, qubit, action name) in emission order.
+        # Kept up to date by add_action so control lookups never rescan every qubit's action list.
+        self.actions_by_time: Dict[int, List[Tuple[int, str, str]]] = {}
+        # Declaration index of each qubit, mirroring the iteration order of `qubits`
+        self.qubit_order: Dict[str, int] = {}
+        # Member keys of each declared qubit register, in index order
+        self.register_members: Dict[str, List[str]] = {}
+        # Globals used in QASM code occasionally
+        self.globals: Dict[str, Any] = {"pi":3.14159,"π":3.14159}
+        # Alternation over the names in `globals`, rebuilt lazily after set_global adds a name
+        self.globals_re: Optional[re.Pattern] = None
+        # Values of expressions already evaluated, keyed by source text (_INVALID if it failed)
+        self.expr_cache: Dict[str, Any] = {}
+        # XML elements of functions or gates
+        self.scripts: Dict[str, Any] = {}
+        # Joined text of elements already visited, keyed by the element itself (not id()) so
+        # that unrolled copies freed mid-run cannot hand their ids, and stale text, to new
+        # elements. Elements inside gate and function definitions are run on every call, so
+        # their text is kept for the whole run; everything else only until its top-level
+        # statement is released.
+        self.script_nodes: Set[Any] = set()
+        self.script_text: Dict[Any, str] = {}
+        self.text_cache: Dict[Any, str] = {}
+        # Chain of scopes used to map parameter names to argument names in gates and functions
+        self.maps: ChainMap[str, str] = ChainMap()
+        # Stack of if conditions to add onto actions
+        self.ifs: Deque[str] = deque()
+        # Statement elements, plus string markers for leaving a scope or an if block
+        self.data_queue: Deque[Union[Any, str]] = deque()
+        self.count = Counter()
+        self.t = self.count.t
+
+    def get_text(self, node: Any) -> str:
+        text = self.text_cache.get(node)
+        if text is None:
+            text = self.script_text.get(node)
+            if text is None:
+                text = "".join(node.itertext())
+                cache = self.script_text if node in self.script_nodes else self.text_cache
+                cache[node] = text
+        return text
+
+    def add_qubit(self, name: str, info: Dict[str, Any]) -> None:
+        self.qubit_order.setdefault(name, len(self.qubit_order))
+        self.qubits[name] = info
+
+    def add_action(self, qubit: str, action: Dict[str, Any], ifs: Optional[Deque[str]] = None) -> None:
+        # Conditions are attached in place; no merged dict is built when no if_stmt is active
+        if ifs:
+            action["if"] = ",".join(ifs)
+        self.qubits[qubit]["actions"].append(action)
+        self.actions_by_time.setdefault(action["time"], []).append((self.qubit_order[qubit], qubit, action["action"]))
+
+    def get_all_ctrls_from_time(self, time: int) -> str:
+        actions_by_time = self.actions_by_time
+        rtn: List[str] = []
+        while time >= 0:
+            if time in actions_by_time:
+                # Latest-declared qubit first, each qubit's actions in emission order
+                for _, qubit, action in sorted(actions_by_time[time], key=lambda a: -a[0]):
+                    if action != 'ctrl':
+                        time = -1
+                        break
+                    rtn.append(qubit)
+            time -= 1
+
+        return ",".join(reversed(rtn))
+
+    def set_global(self, name: str, value: Any) -> None:
+        self.globals[name] = value
+        self.globals_re = None
+
+    def replace_globals(self, string: str) -> str:
+        globals = self.globals
+        if not globals:
+            return string
+        if self.globals_re is None:
+            self.globals_re = re.compile(r"\b(" + "|".join(map(re.escape, globals)) + r")\b")
+        return self.globals_re.sub(lambda m: str(globals[m.group(1)]), string)
+
+    def evaluate(self, expr: str) -> Any:
+        """Evaluate a constant arithmetic expression from QASM source (numbers and + - * / // % ** only)"""
+        value = self.expr_cache.get(expr)
+        if value is None:
+            if expr.isascii() and expr.isdigit() and (expr[0] != "0" or expr == "0"):
+                value = int(expr)
+            else:
+                try:
+                    # Leading spaces and tabs would be an indentation error to ast.parse
+                    value = eval_constant(ast.parse(expr.lstrip(" \t"), mode="eval").body)
+                except Exception:
+                    self.expr_cache[expr] = _INVALID
+                    raise
+            self.expr_cache[expr] = value
+        elif value is _INVALID:
+            raise ValueError(f"Cannot evaluate expression '{expr}'")
+        return value
+
+
+# Save Script Blocks
+def handle_script(child: Any, state: ParseState) -> None:
+    name = child.find(PATH_NAME)
+    state.scripts[name.text] = child
+    state.script_nodes.update(child.iter())
+
+# New Qubit found, store
+def handle_decl_stmt(child: Any, state: ParseState) -> None:
+    if child.find(PATH_DECL_LET) != None:
+        name = state.get_text(child.find(PATH_DECL_NAME))
+        target = state.get_text(child.find(PATH_DECL_INIT))
+        target_name = target.split("[")[0]
+        start,stop = 0,1
+        if "[" in target:
+            if ':' in target:
+                start = int(state.replace_globals(target.split('[')[1].split(':')[0]))
+                end = int(state.replace_globals(target.split(']')[0].split(':')[1]))+1
+            else:
+                start = int(state.replace_globals(target.split('[')[1].split(']')[0]))
+                end = start+1
+        i = start
+        while i != end:
+            state.maps[name+f"[{i-start}]"] = target_name+f'[{i}]'
+            i += 1
 
-                    if mname in ["ctrl","negctrl"]:
-                        print(num)
-                        for i in range(num):
-                            qarg = qargs.pop(0)
-                            qubits[qarg]["actions"].append({"action":mname,"time":_t,"line":line} | get_ifs(ifs))
-                            #ctrls.append(qarg)
-
-            # First, check if call is to any std gate
-            if name in gates:
-                _t = t() if not t_set else _t
-                # If gate is a simple, unitary one
-                if name in unitary_gates:
-                    qubits[qargs[0]]["actions"].append({"action":"gate-call","type":name,"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[0]} | get_ifs(ifs))
-                # If gate is a simple control gate
-                elif name in unitary_control:
-                    qubits[qargs[0]]["actions"].append({"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
-                    # ctrls.append(qargs[0])
-                    qubits[qargs[1]]["actions"].append({"action":"ctrl-gate-call","type":name,"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[1]} | get_ifs(ifs))
-                # If gate is complex, but no control (just swap right now)
-                elif name == "swap":
-                    qubits[qargs[0]]["actions"].append({"action":"gate-call","type":"swap","with":qargs[1],"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[0]} | get_ifs(ifs))
-                    qubits[qargs[1]]["actions"].append({"action":"gate-call","type":"swap","with":qargs[0],"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[1]} | get_ifs(ifs))
-                # If gate is complex control (needs custom per gate)
-                elif name == "ccx":
-                    qubits[qargs[0]]["actions"].append({"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
-                    # ctrls.append(qargs[0])
-                    qubits[qargs[1]]["actions"].append({"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[1]})
-                    # ctrls.append(qargs[1])
-                    qubits[qargs[2]]["actions"].append({"action":"ctrl-gate-call","type":"ccx","ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[2]} | get_ifs(ifs))
-                elif name == "cswap":
-                    qubits[qargs[0]]["actions"].append({"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
-                    # ctrls.append(qargs[0])
-                    qubits[qargs[1]]["actions"].append({"action":"ctrl-gate-call","type":"cswap","ctrl":get_all_ctrls_from_time(_t),"with":qargs[2],"time":_t,"line":line,"local_name":local_qargs[1]} | get_ifs(ifs))
-                    qubits[qargs[2]]["actions"].append({"action":"ctrl-gate-call","type":"cswap","ctrl":get_all_ctrls_from_time(_t),"with":qargs[1],"time":_t,"line":line,"local_name":local_qargs[2]} | get_ifs(ifs))
-
-            # If not, handle user-defined gates, but ONLY if qargs exists
-            elif len(qargs) > 0:
-                if name in scripts:
-                    script = scripts[name]
-                    qparams = script.findall(f"./{ns}parameter_list[@type='quantum']/{ns}parameter")
-                    qparams = ["".join(x.itertext()) for x in qparams]
-                    assert len(qargs) == len(qparams)
-                    maps.insert(0,maps[0] | {qparams[i]:qargs[i] for i in range(len(qargs))})
-                    instructions = []
-                    for instr in script.find(f"./{ns}block/{ns}block_content"):
-                        instructions.append(instr)
-                    instructions.append("pop-map-stack")
-                    data_queue = instructions + data_queue
-                # Can't find the gate
-                else:
-                    _t = t() if not t_set else _t
-                    for i in len(qargs):
-                        qubits[qargs[i]]["actions"].append({"action":"gate-call","type":name,"status":"unknown","ctrl":get_all_ctrls_from_time(_t),"time":_t,"local_name":local_qargs[i]} | get_ifs(ifs))
-        
-        elif name in scripts and scripts[name].tag.endswith("function"):
-            script = scripts[name]
-            qparams = script.findall(f"./{ns}parameter_list/{ns}parameter")
-            qparams = ["".join(qparam.itertext()) for qparam in qparams if "qubit" in "".join(qparam.itertext())]
-            # print("@",name,qparams)
-            assert len(qargs) == len(qparams)
-            new_map = {}
-            for i in range(len(qargs)):
-                qarg, qparam = qargs[i], qparams[i]
-                if '[' in qparam:
-                    size = int(replace_globals(qparam.split('[')[1].split(']')[0]))
-                    param_name = qparam.split('[')[0]
-                    for j in range(size):
-                        new_map |= {param_name+f"[j]":qarg+f"[j]"}
+    else:
+        typ = child.find(PATH_DECL_TYPE_NAME)
+        typ = state.get_text(typ)
+        if "qubit" in typ:
+            name = child.find(PATH_DECL_NAME).text
+            if "[" in typ:
+                amt = int(state.replace_globals(typ.split("[")[1][:-1]))
+                for i in range(amt):
+                    state.add_qubit(f"{name}[{i}]", {"type":"array","index":i,"actions":[]})
+                state.register_members[name] = [f"{name}[{i}]" for i in range(amt)]
+            else:
+                state.add_qubit(name, {"type":"named","actions":[]})
+        elif "const" in state.get_text(child.find(PATH_DECL_TYPE)):
+            name = child.find(PATH_DECL_NAME).text
+            value = state.evaluate(state.replace_globals(state.get_text(child.find(PATH_DECL_INIT))))
+            state.set_global(name, value)
+            if state.verbose:
+                print("|",state.globals)
+
+# Reset Statement
+def handle_reset(child: Any, state: ParseState) -> None:
+    target = state.get_text(child.find(PATH_EXPR))
+    line = int(child.attrib["pos"])
+    _t = state.t()
+    for qubit in ([target] if target in state.qubits else state.register_members.get(target, [])):
+        state.add_action(qubit, {"action":"reset","time":_t,"line":line}, state.ifs)
+
+# expr_stmt, check for a call! Will only find the first call if there are multiple
+# Hot state attributes are bound to locals up front
+def handle_expr_stmt(child: Any, state: ParseState) -> None:
+    ifs = state.ifs
+    qubits = state.qubits
+    register_members = state.register_members
+    add_action = state.add_action
+    get_all_ctrls_from_time = state.get_all_ctrls_from_time
+    replace_globals = state.replace_globals
+    get_text = state.get_text
+    line = int(child.attrib["pos"])
+    call = child.find(PATH_ANY_CALL)
+    if call == None:
+        measure_op = child.find(PATH_MEASURE_OP)
+        if measure_op == None:
+            return
+        expr = get_text(child.find(PATH_EXPR))
+        store = expr.split("=")[0].strip()
+        qubit = expr.split("measure")[1].strip()
+        _t = state.t()
+        if qubit in qubits:
+            add_action(qubit, {"action":"measure","store":store,"time":_t,"line":line}, ifs)
+        elif qubit in register_members:
+            for q in register_members[qubit]:
+                add_action(q, {"action":"measure","store":store,"time":_t,"line":line}, ifs)
+        else:
+            raise InvalidQubitArgumentError(qubit)
+
+        return
+    name = call.find(PATH_NAME).text
+    scripts = state.scripts
+    # Get quantum args
+    # Argument names as written in the current scope, then mapped to the caller's qubits
+    local_qargs = [get_text(x) for x in call.iterfind(PATH_QARGS)]
+    qargs = [state.maps.get(arg, arg) for arg in local_qargs]
+    if len(qargs) == 0:
+        return
+    # Check if call is on a function or gate
+    if name not in scripts and name not in gates:
+        raise Exception("Cannot find valid call name!")
+    # NAME is a gate!
+    elif name in gates or (name in scripts and scripts[name].tag.endswith("gate")):
+        # Check to ensure qubits exist, and are all single
+        arrays = []
+        size = -1
+        for qarg in qargs:
+            if qarg not in qubits:
+                if qarg in register_members:
+                    arrays.append(qarg)
+                    if size == -1:
+                        size = len(register_members[qarg])
+                    else:
+                        if size != len(register_members[qarg]):
+                            raise ArraySizeMismatchError(arrays[0],qarg)
                 else:
-                    new_map |= {qparam:qarg}
-            maps.insert(0,maps[0] | new_map)
+                    raise InvalidQubitArgumentError(qarg)
+        # Duplicate short-hand array calls
+        if len(arrays) != 0:
+            # Locate the argument nodes to rewrite once, on the original statement
+            change_nodes = {}
+            for qarg in arrays:
+                for node in child.findall(PATH_QARG_NAMED % qarg):
+                    if node not in change_nodes:
+                        change_nodes[node] = (qarg, get_text(node))
             instructions = []
-            for instr in script.find(f"./{ns}block/{ns}block_content"):
-                instructions.append(instr)
-            instructions.append("pop-map-stack")
-            data_queue = instructions + data_queue
-        else:
-            raise Exception("Should not reach here")
+            for i in range(size):
+                copy = deepcopy(child)
+                # Copies share the original's structure, so a parallel walk finds the matching nodes
+                matches = [(node, change_nodes[orig]) for orig, node in zip(child.iter(), copy.iter()) if orig in change_nodes]
+                for node, (qarg, text) in matches:
+                    text = text.replace(qarg,qarg+f"[{i}]")
+                    tail = node.tail
+                    node.clear()
+                    node.text = str(text)
+                    node.tail = tail
+                instructions.append(copy)
+            state.data_queue.extendleft(reversed(instructions))
+            return
+        t_set = False
+        modifiers = call.findall(PATH_MODIFIERS)
+        #ctrls = []
+        if len(modifiers) > 0:
+            t_set = True
+            _t = state.t()
+            for modifier in modifiers:
+                if modifier.find(PATH_MODIFIER_CALL) != None:
+                    mname = modifier.find(PATH_MODIFIER_CALL_NAME).text
+                    num = int(replace_globals(get_text(modifier.find(PATH_MODIFIER_CALL_ARG))))
+                elif modifier.find(PATH_MODIFIER_NAME) != None:
+                    mname = modifier.find(PATH_MODIFIER_NAME).text
+                    num = 1
+                else:
+                    raise Exception("Weird mofidier")
 
-    elif tag == "if_stmt":
-        instructions = []
-        if_stmt = child.find(f"./{ns}if")
-        if_cond = "".join(if_stmt.find(f"./{ns}condition/{ns}expr").itertext())
-        if_block = if_stmt.find(f"./{ns}block/{ns}block_content")
-        instructions.append("add-if-cond "+if_cond)
-        for stmt in if_block:
-            instructions.append(stmt)
-        instructions.append("pop-if-cond")
-        data_queue = instructions + data_queue
-
-    elif tag == "for":
-        loop_name = child.find(f"./{ns}control/{ns}init/{ns}decl/{ns}name").text
-        index = "".join(child.find(f"./{ns}control/{ns}range/{ns}expr/{ns}index/{ns}expr").itertext())
-        for_block = child.find(f"./{ns}block/{ns}block_content")
-        index = index.split(":")
-        start = eval(replace_globals(index[0]))
-        stop = eval(replace_globals(index[-1].replace("]","")))
-        step = eval(replace_globals(index[1])) if len(index) == 3 else 1
-        loop_range = list(range(start, stop+1 if stop > start else stop - 1,step))
+                if mname in ["ctrl","negctrl"]:
+                    if state.verbose:
+                        print(num)
+                    for i in range(num):
+                        qarg = qargs.pop(0)
+                        add_action(qarg, {"action":mname,"time":_t,"line":line}, ifs)
+                        #ctrls.append(qarg)
+
+        # First, check if call is to any std gate
+        if name in gates:
+            _t = state.t() if not t_set else _t
+            # If gate is a simple, unitary one
+            if name in unitary_gates:
+                add_action(qargs[0], {"action":"gate-call","type":name,"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[0]}, ifs)
+            # If gate is a simple control gate
+            elif name in unitary_control:
+                add_action(qargs[0], {"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
+                # ctrls.append(qargs[0])
+                add_action(qargs[1], {"action":"ctrl-gate-call","type":name,"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[1]}, ifs)
+            # If gate is complex, but no control (just swap right now)
+            elif name == "swap":
+                add_action(qargs[0], {"action":"gate-call","type":"swap","with":qargs[1],"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[0]}, ifs)
+                add_action(qargs[1], {"action":"gate-call","type":"swap","with":qargs[0],"ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[1]}, ifs)
+            # If gate is complex control (needs custom per gate)
+            elif name == "ccx":
+                add_action(qargs[0], {"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
+                # ctrls.append(qargs[0])
+                add_action(qargs[1], {"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[1]})
+                # ctrls.append(qargs[1])
+                add_action(qargs[2], {"action":"ctrl-gate-call","type":"ccx","ctrl":get_all_ctrls_from_time(_t),"time":_t,"line":line,"local_name":local_qargs[2]}, ifs)
+            elif name == "cswap":
+                add_action(qargs[0], {"action":"ctrl","time":_t,"line":line,"local_name":local_qargs[0]})
+                # ctrls.append(qargs[0])
+                add_action(qargs[1], {"action":"ctrl-gate-call","type":"cswap","ctrl":get_all_ctrls_from_time(_t),"with":qargs[2],"time":_t,"line":line,"local_name":local_qargs[1]}, ifs)
+                add_action(qargs[2], {"action":"ctrl-gate-call","type":"cswap","ctrl":get_all_ctrls_from_time(_t),"with":qargs[1],"time":_t,"line":line,"local_name":local_qargs[2]}, ifs)
+
+        # If not, handle user-defined gates, but ONLY if qargs exists
+        elif len(qargs) > 0:
+            if name in scripts:
+                script = scripts[name]
+                qparams = script.findall(PATH_QPARAMS)
+                qparams = [get_text(x) for x in qparams]
+                assert len(qargs) == len(qparams)
+                state.maps = state.maps.new_child({qparams[i]:qargs[i] for i in range(len(qargs))})
+                instructions = []
+                for instr in script.find(PATH_BLOCK):
+                    instructions.append(instr)
+                instructions.append("pop-map-stack")
+                state.data_queue.extendleft(reversed(instructions))
+            # Can't find the gate
+            else:
+                _t = state.t() if not t_set else _t
+                for i in range(len(qargs)):
+                    add_action(qargs[i], {"action":"gate-call","type":name,"status":"unknown","ctrl":get_all_ctrls_from_time(_t),"time":_t,"local_name":local_qargs[i]}, ifs)
+
+    elif name in scripts and scripts[name].tag.endswith("function"):
+        script = scripts[name]
+        qparams = script.findall(PATH_PARAMS)
+        qparams = [get_text(qparam) for qparam in qparams if "qubit" in get_text(qparam)]
+        # print("@",name,qparams)
+        assert len(qargs) == len(qparams)
+        new_map: Dict[str, str] = {}
+        for i in range(len(qargs)):
+            qarg, qparam = qargs[i], qparams[i]
+            if '[' in qparam:
+                size = int(replace_globals(qparam.split('[')[1].split(']')[0]))
+                param_name = qparam.split('[')[0]
+                for j in range(size):
+                    new_map |= {param_name+f"[j]":qarg+f"[j]"}
+            else:
+                new_map |= {qparam:qarg}
+        state.maps = state.maps.new_child(new_map)
         instructions = []
-        for val in loop_range:
-            xml_text = ET.tostring(for_block,encoding='utf-8')
-            xml_text = xml_text.decode().replace("ns0:","").replace(":ns0","")[:-1]
-            copy = ET.fromstring(xml_text)
-            change_nodes = copy.findall(f".//{ns}expr[{ns}name='{loop_name}']")
-            for node in change_nodes:
-                text = ''.join(node.itertext())
-                text = text.replace(loop_name,str(val))
-                try:
-                    text = eval(text.replace("]",""))
-                except:
-                    continue
-                tail = node.tail
-                node.clear()
-                node.text = str(text)
-                node.tail = tail
-            instructions += [stmt for stmt in copy]
-        data_queue = instructions + data_queue
-
-    elif tag == "box":
-        block = child.find(f"./{ns}block/{ns}block_content")
-        data_queue = [stmt for stmt in block] + data_queue
-
-    elif tag == "measure":
-        _t = t()
-        line = int(child.attrib["pos"])
-        measured_qubit = child.find(f"./{ns}expr")
-        store_name = child.find(f"./{ns}name")
-        if measured_qubit.findall(f".//{ns}index/{ns}expr/{ns}operator[.=':']"):
-            index = "".join(measured_qubit.find(f".//{ns}index").itertext())[1:-1]
-            start, end = [int(x) for x in index.split(":")]
-            q_name = "".join(measured_qubit.find(f"./{ns}name").itertext()).split("[")[0]
-            name = "".join(store_name.find(f"./{ns}name").itertext()).split("[")[0]
-            for i in range(start, end+1):
-                qubits[q_name+f"[{i}]"]["actions"].append({"action":"measure","store":name+f"[{i}]","time":_t,"line":line} | get_ifs(ifs))
-        else:
-            qubit = "".join(measured_qubit.itertext())
-            if qubit in qubits:
-                qubits[qubit]["actions"].append({"action":"measure","store":"".join(store_name.itertext()),"time":_t,"line":line} | get_ifs(ifs))
-            elif qubit + "[0]" in qubits:
-                i = 0
-                while qubit+f"[{i}]" in qubits:
-                    qubits[qubit+f"[{i}]"]["actions"].append({"action":"measure","store":"".join(store_name.itertext())+f"[{i}]","time":_t,"line":line} | get_ifs(ifs))
-                    i += 1
-
-    elif tag == "barrier":
-        _t = t()
-        line = int(child.attrib["pos"])
-        qargs = child.findall(f".//{ns}argument_list/{ns}argument")
-        if len(qargs) > 0:
-            for qarg in ["".join(arg.itertext()) for arg in qargs]:
-                if qarg in qubits:
-                    qubits[qarg]["actions"].append({"action":"barrier","time":_t,"line":line} | get_ifs(ifs))
-                elif qarg+"[0]" in qubits:
-                    for qubit in qubits:
-                        if qubit.startswith(qarg):
-                            qubits[qubit]["actions"].append({"action":"barrier","time":_t,"line":line} | get_ifs(ifs))
-        else:
-            for qubit in qubits:
-                if qubit["type"] == "physical" and len(qubit["actions"]) == 0:
-                    continue
-                qubits[qubit]["actions"].append({"action":"barrier","time":_t,"line":line} | get_ifs(ifs))
-
-
-
-
-# for qubit in qubits:
-#     print(qubit)
-#     for item in qubits[qubit]["actions"]:
-#         print(f"\t{item}")
-
-# for i in range(count.count):
-#     for qubit in qubits:
-#         for item in qubits[qubit]["actions"]:
-#             if item["time"] == i:
-#                 print(qubit,"->",item)
-#     print()
+        for instr in script.find(PATH_BLOCK):
+            instructions.append(instr)
+        instructions.append("pop-map-stack")
+        state.data_queue.extendleft(reversed(instructions))
+    else:
+        raise Exception("Should not reach here")
+
+def handle_if_stmt(child: Any, state: ParseState) -> None:
+    instructions = []
+    if_stmt = child.find(PATH_IF)
+    if_cond = state.get_text(if_stmt.find(PATH_CONDITION))
+    if_block = if_stmt.find(PATH_BLOCK)
+    instructions.append("add-if-cond "+if_cond)
+    for stmt in if_block:
+        instructions.append(stmt)
+    instructions.append("pop-if-cond")
+    state.data_queue.extendleft(reversed(instructions))
+
+def handle_for(child: Any, state: ParseState) -> None:
+    loop_name = child.find(PATH_LOOP_VAR).text
+    index = state.get_text(child.find(PATH_LOOP_RANGE))
+    for_block = child.find(PATH_BLOCK)
+    bounds = index.split(":")
+    start = state.evaluate(state.replace_globals(bounds[0]))
+    stop = state.evaluate(state.replace_globals(bounds[-1].replace("]","")))
+    step = state.evaluate(state.replace_globals(bounds[1])) if len(bounds) == 3 else 1
+    loop_range = list(range(start, stop+1 if stop > start else stop - 1,step))
+    # Locate expressions using the loop variable once, on the original block
+    change_nodes = {node:state.get_text(node) for node in for_block.findall(PATH_EXPR_NAMED % loop_name)}
+    instructions = []
+    for val in loop_range:
+        copy = deepcopy(for_block)
+        matches = [(node, change_nodes[orig]) for orig, node in zip(for_block.iter(), copy.iter()) if orig in change_nodes]
+        for node, text in matches:
+            text = text.replace(loop_name,str(val))
+            try:
+                text = state.evaluate(text.replace("]",""))
+            except Exception:
+                continue
+            tail = node.tail
+            node.clear()
+            node.text = str(text)
+            node.tail = tail
+        instructions += [stmt for stmt in copy]
+    state.data_queue.extendleft(reversed(instructions))
+
+def handle_box(child: Any, state: ParseState) -> None:
+    block = child.find(PATH_BLOCK)
+    state.data_queue.extendleft(reversed(block))
+
+def handle_measure(child: Any, state: ParseState) -> None:
+    _t = state.t()
+    line = int(child.attrib["pos"])
+    measured_qubit = child.find(PATH_EXPR)
+    store_name = child.find(PATH_NAME)
+    if measured_qubit.findall(PATH_RANGE_OP):
+        index = state.get_text(measured_qubit.find(PATH_ANY_INDEX))[1:-1]
+        start, end = [int(x) for x in index.split(":")]
+        q_name = state.get_text(measured_qubit.find(PATH_NAME)).split("[")[0]
+        name = state.get_text(store_name.find(PATH_NAME)).split("[")[0]
+        for i in range(start, end+1):
+            state.add_action(q_name+f"[{i}]", {"action":"measure","store":name+f"[{i}]","time":_t,"line":line}, state.ifs)
+    else:
+        qubit = state.get_text(measured_qubit)
+        if qubit in state.qubits:
+            state.add_action(qubit, {"action":"measure","store":state.get_text(store_name),"time":_t,"line":line}, state.ifs)
+        elif qubit in state.register_members:
+            for i, q in enumerate(state.register_members[qubit]):
+                state.add_action(q, {"action":"measure","store":state.get_text(store_name)+f"[{i}]","time":_t,"line":line}, state.ifs)
+
+def handle_barrier(child: Any, state: ParseState) -> None:
+    _t = state.t()
+    line = int(child.attrib["pos"])
+    qargs = child.findall(PATH_ARGS)
+    if len(qargs) > 0:
+        for qarg in [state.get_text(arg) for arg in qargs]:
+            if qarg in state.qubits:
+                state.add_action(qarg, {"action":"barrier","time":_t,"line":line}, state.ifs)
+            elif qarg in state.register_members:
+                for qubit in state.register_members[qarg]:
+                    state.add_action(qubit, {"action":"barrier","time":_t,"line":line}, state.ifs)
+    else:
+        for qubit in state.qubits:
+            if state.qubits[qubit]["type"] == "physical" and len(state.qubits[qubit]["actions"]) == 0:
+                continue
+            state.add_action(qubit, {"action":"barrier","time":_t,"line":line}, state.ifs)
+
+# Statement handlers keyed by the raw, namespaced element tag
+HANDLERS = {
+    f"{ns}gate": handle_script,
+    f"{ns}function": handle_script,
+    f"{ns}decl_stmt": handle_decl_stmt,
+    f"{ns}reset": handle_reset,
+    f"{ns}expr_stmt": handle_expr_stmt,
+    f"{ns}if_stmt": handle_if_stmt,
+    f"{ns}for": handle_for,
+    f"{ns}box": handle_box,
+    f"{ns}measure": handle_measure,
+    f"{ns}barrier": handle_barrier,
+}
+
+
+def main(argv: List[str]) -> Dict[str, Any]:
+    #fname = "examples/3.0/adder"
+    #fname = "examples/custom/hadamard_cnot"
+
+    #tree = ET.parse(f'{fname}.qasm.xml')
+    #print(argv[1].replace("\\","/"))
+    ap = argparse.ArgumentParser(description="Parse srcML OpenQASM XML into per-qubit actions (out.json)")
+    ap.add_argument("xml", help="Path to the .qasm.xml file produced by srcML")
+    ap.add_argument("--verbose", action="store_true",
+                    help="Print diagnostics while parsing and every action grouped by time step")
+    args = ap.parse_args(argv[1:])
+    # Statements are streamed from the file rather than loaded as one tree
+    path = args.xml.replace("\\","/")
+    statements = iter_statements(path)
+
+    state = ParseState(args.verbose)
+    for i in range(6):
+        state.add_qubit(f"${i}", {"type":"physical","actions":[]})
+
+    data_queue = state.data_queue
+    statement: Optional[Any] = None
+
+    while True:
+        # Pull the next statement only once everything queued by the current one is done,
+        # at which point its subtree can be released
+        if not data_queue:
+            if statement is not None and statement.tag not in RETAINED_TAGS:
+                statement.clear()
+                state.text_cache.clear()
+            statement = next(statements, None)
+            if statement is None:
+                break
+            data_queue.append(statement)
+        child = data_queue.popleft()
+        if isinstance(child, str):
+            if child == "pop-map-stack":
+                state.maps = state.maps.parents
+            if child.startswith("add-if-cond"):
+                state.ifs.appendleft(" ".join(child.split()[1:]))
+            elif child.startswith("pop-if-cond"):
+                state.ifs.popleft()
+            continue
+        handler = HANDLERS.get(child.tag)
+        if handler is not None:
+            handler(child, state)
+    # Release the elements pinned by the text caches
+    state.text_cache.clear()
+    state.script_text.clear()
+
+
+    # for qubit in qubits:
+    #     print(qubit)
+    #     for item in qubits[qubit]["actions"]:
+    #         print(f"\t{item}")
+
+    # for i in range(count.count):
+    #     for qubit in qubits:
+    #         for item in qubits[qubit]["actions"]:
+    #             if item["time"] == i:
+    #                 print(qubit,"->",item)
+    #     print()
+
+
+    # Group actions by time in one sweep; qubit then emission order is kept within each step
+    qubits = state.qubits
+    time_array: Dict[int, List[Tuple[str, Dict[str, Any]]]] = {}
+    for qubit, info in qubits.items():
+        for item in info["actions"]:
+            time_array.setdefault(item["time"], []).append((qubit,item))
+    if args.verbose:
+        for i in range(state.count.count):
+            print("TIME",i)
+            for qubit, item in time_array.get(i, ()):
+                print(f"\t{qubit}->{item}")
+    #print(time_array)
 
+    qubits["_filename"] = path
 
-time_array = {}
-for i in range(count.count):
-    time_array[i] = []
-    print("TIME",i)
-    for qubit in qubits:
-        for item in qubits[qubit]["actions"]:
-            if item["time"] == i:
-                print(f"\t{qubit}->{item}")
-                time_array[i].append((qubit,item))
-#print(time_array)
+    return qubits
 
-qubits["_filename"] = sys.argv[1].replace("\\","/")
 
-data = json.dumps(qubits,indent=4)
-with open("out.json",'w') as file:
-    file.write(data)
+if __name__ == "__main__":
+    qubits = main(sys.argv)
 
+    # Both serializers write the same two-space layout
+    if orjson is not None:
+        data = orjson.dumps(qubits, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(qubits,indent=2,ensure_ascii=False).encode("utf-8")
+    with open("out.json",'wb') as file:
+        file.write(data)
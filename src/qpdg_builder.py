@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+from array import array
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import hashlib
 import json
 import itertools
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
 
 # -----------------------------
@@ -12,8 +18,9 @@ import itertools
 
 NodeId = str
 
-@dataclass(frozen=True)
-class Node:
+# Nodes and edges are plain tuples so hashing and storage stay cheap on large graphs;
+# free-form metadata lives in QPDG.node_meta / QPDG.edge_meta instead.
+class Node(NamedTuple):
     id: NodeId
     kind: str                   # "QOP" | "MEASURE" | "CDEF" | later: "CPRED", "CSTMT"
     qubit: Optional[str] = None # for quantum nodes
@@ -23,33 +30,121 @@ class Node:
     gate: Optional[str] = None
     ctrl: Optional[str] = None
     store: Optional[str] = None # for measurement and cdef
-    meta: Dict[str, Any] = field(default_factory=dict)
 
-@dataclass(frozen=True)
-class Edge:
+class Edge(NamedTuple):
     src: NodeId
     dst: NodeId
     kind: str                   # "q_temporal" | "q_entanglement" | "q_measure" | "q2c_measure" | ...
-    meta: Dict[str, Any] = field(default_factory=dict)
+
+class CSRGraph(NamedTuple):
+    """Read-only compressed sparse row view of a QPDG's outgoing edges (see QPDG.freeze)."""
+    ids: List[NodeId]           # node index -> node id
+    id_to_index: Dict[NodeId, int]  # node id -> node index
+    indptr: array               # edges leaving node i are positions indptr[i] .. indptr[i+1]-1
+    indices: array              # destination node index per edge position
+    kinds: array                # per edge position, an index into kind_names
+    kind_names: List[str]
 
 @dataclass
 class QPDG:
+    # Change the graph only through add_node/add_edge: the edge indexes and cached views
+    # below (and the DOT file cache in qpdg_viz) are not told about direct edits to these
     nodes: Dict[NodeId, Node] = field(default_factory=dict)
     edges: List[Edge] = field(default_factory=list)
-
-    def add_node(self, node: Node) -> None:
+    # Extra attributes by node id, and by position in `edges`; only entries that have any
+    node_meta: Dict[NodeId, Dict[str, Any]] = field(default_factory=dict)
+    edge_meta: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    # Edges indexed by source / destination, kept in insertion order alongside `edges`
+    _out: Dict[NodeId, List[Edge]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _in: Dict[NodeId, List[Edge]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Integer CSR view for read-heavy analysis; built by freeze(), dropped by any later change
+    csr: Optional[CSRGraph] = field(default=None, init=False, repr=False, compare=False)
+    # Cached fingerprint(); dropped by any later change, like csr
+    _fp: Optional[int] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        for e in self.edges:
+            self._index_edge(e)
+
+    def _index_edge(self, e: Edge) -> None:
+        self._out.setdefault(e.src, []).append(e)
+        self._in.setdefault(e.dst, []).append(e)
+
+    def add_node(self, node: Node, **meta: Any) -> None:
         if node.id in self.nodes:
             return
         self.nodes[node.id] = node
+        if meta:
+            self.node_meta[node.id] = meta
+        self.csr = None
+        self._fp = None
 
     def add_edge(self, src: NodeId, dst: NodeId, kind: str, **meta: Any) -> None:
-        self.edges.append(Edge(src=src, dst=dst, kind=kind, meta=dict(meta)))
+        e = Edge(src=src, dst=dst, kind=kind)
+        if meta:
+            self.edge_meta[len(self.edges)] = meta
+        self.edges.append(e)
+        self._index_edge(e)
+        self.csr = None
+        self._fp = None
 
     def outgoing(self, nid: NodeId) -> List[Edge]:
-        return [e for e in self.edges if e.src == nid]
+        return list(self._out.get(nid, ()))
 
     def incoming(self, nid: NodeId) -> List[Edge]:
-        return [e for e in self.edges if e.dst == nid]
+        return list(self._in.get(nid, ()))
+
+    def fingerprint(self) -> int:
+        """
+        64-bit hash of the node tuples and edge triples, in order. Equal fingerprints mean
+        the same DOT output, so viewers can skip re-serializing an unchanged graph.
+        Computed on first use and kept until add_node/add_edge changes the graph.
+        """
+        if self._fp is not None:
+            return self._fp
+        h = hashlib.blake2b(digest_size=8)
+        h.update(b"%d %d\n" % (len(self.nodes), len(self.edges)))
+        for n in self.nodes.values():
+            h.update("\x1f".join(map(str, n)).encode("utf-8"))
+            h.update(b"\x1e")
+        for e in self.edges:
+            h.update("\x1f".join(e).encode("utf-8"))
+            h.update(b"\x1e")
+        self._fp = int.from_bytes(h.digest(), "little")
+        return self._fp
+
+    @property
+    def known_fingerprint(self) -> Optional[int]:
+        """fingerprint() if it was already computed since the last change, else None."""
+        return self._fp
+
+    def freeze(self) -> CSRGraph:
+        """
+        Build (or return) the CSR view: nodes numbered in insertion order, each node's
+        outgoing edges stored contiguously in insertion order. The edge list is kept
+        for consumers such as qpdg_viz.
+        """
+        if self.csr is not None:
+            return self.csr
+        ids = list(self.nodes)
+        index = {nid: i for i, nid in enumerate(ids)}
+        # Edges may name endpoints that were never added as nodes
+        for e in self.edges:
+            for nid in (e.src, e.dst):
+                if nid not in index:
+                    index[nid] = len(ids)
+                    ids.append(nid)
+        kind_codes: Dict[str, int] = {}
+        indptr = array("i", [0])
+        indices = array("i")
+        kinds = array("B")
+        for nid in ids:
+            for e in self._out.get(nid, ()):
+                indices.append(index[e.dst])
+                kinds.append(kind_codes.setdefault(e.kind, len(kind_codes)))
+            indptr.append(len(indices))
+        self.csr = CSRGraph(ids, index, indptr, indices, kinds, list(kind_codes))
+        return self.csr
 
 
 # -----------------------------
@@ -118,11 +213,10 @@ class QPDGBuilder:
                     self.g.add_node(mnode)
 
                     # Temporal edge on wire
-                    self._add_temporal_edge(qubit, mid)
+                    prev = self._add_temporal_edge(qubit, mid)
 
                     # Measurement dependence: last quantum op on this wire -> measure
                     # (If temporal edge already encodes that, we still label explicitly for QPDG)
-                    prev = self._prev_on_wire(qubit, mid)
                     if prev is not None:
                         self.g.add_edge(prev, mid, "q_measure")
 
@@ -131,10 +225,9 @@ class QPDGBuilder:
                         cid = self._make_cdef_id(store, time, line, qubit)
                         cnode = Node(
                             id=cid, kind="CDEF", time=time, line=line,
-                            action="def", store=store,
-                            meta={"source": "measure", "qubit": qubit}
+                            action="def", store=store
                         )
-                        self.g.add_node(cnode)
+                        self.g.add_node(cnode, source="measure", qubit=qubit)
                         self.g.add_edge(mid, cid, "q2c_measure")
 
                         # Track last def of that classical symbol for future c_data edges
@@ -150,10 +243,9 @@ class QPDGBuilder:
                 qid = self._make_qnode_id(qubit, time, line, action, gate)
                 qnode = Node(
                     id=qid, kind="QOP", qubit=qubit, time=time, line=line,
-                    action=action, gate=gate, ctrl=ctrl,
-                    meta={"local_name": local_name}
+                    action=action, gate=gate, ctrl=ctrl
                 )
-                self.g.add_node(qnode)
+                self.g.add_node(qnode, local_name=local_name)
 
                 # Temporal edge on wire
                 self._add_temporal_edge(qubit, qid)
@@ -170,21 +262,13 @@ class QPDGBuilder:
 
         return self.g
 
-    def _prev_on_wire(self, qubit: str, current: NodeId) -> Optional[NodeId]:
-        # Find immediate predecessor based on stored last pointer before updating.
-        # We store last pointer during _add_temporal_edge, so to get prev we need a lookup:
-        # We'll approximate by scanning incoming temporal edges.
-        inc = [e for e in self.g.incoming(current) if e.kind == "q_temporal"]
-        if not inc:
-            return None
-        # There should be at most one temporal predecessor.
-        return inc[0].src
-
-    def _add_temporal_edge(self, qubit: str, nid: NodeId) -> None:
+    def _add_temporal_edge(self, qubit: str, nid: NodeId) -> Optional[NodeId]:
+        # Returns the node that was last on the wire, i.e. nid's temporal predecessor
         prev = self._last_on_wire.get(qubit)
         if prev is not None:
             self.g.add_edge(prev, nid, "q_temporal")
         self._last_on_wire[qubit] = nid
+        return prev
 
     def _add_entanglement_edges(self, out: Dict[str, Any]) -> None:
         """
@@ -193,17 +277,21 @@ class QPDGBuilder:
           - connect ctrl <-> (targ or ctrl-gate-call or ctrl-gate-call style)
         We'll implement a robust version that uses the action labels present in out.json.
         """
-        for (time, line), node_ids in self._by_time_line.items():
+        nodes = self.g.nodes
+        for node_ids in self._by_time_line.values():
             if len(node_ids) < 2:
                 continue
 
-            # Partition nodes by action type
-            def node_action(nid: NodeId) -> str:
-                return self.g.nodes[nid].action or ""
-
-            ctrls = [nid for nid in node_ids if node_action(nid) == "ctrl"]
+            # Partition nodes by action type in one pass
             # Commonly targets appear as "targ" or "ctrl-gate-call" (as in your out.json)
-            tgts = [nid for nid in node_ids if node_action(nid) in {"targ", "ctrl-gate-call"}]
+            ctrls: List[NodeId] = []
+            tgts: List[NodeId] = []
+            for nid in node_ids:
+                action = nodes[nid].action
+                if action == "ctrl":
+                    ctrls.append(nid)
+                elif action == "targ" or action == "ctrl-gate-call":
+                    tgts.append(nid)
 
             # If we can't classify cleanly, fall back to fully connecting within the group
             if not ctrls or not tgts:
@@ -219,8 +307,10 @@ class QPDGBuilder:
 
 
 def load_outjson(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # orjson when installed; both parse the UTF-8 bytes directly
+    with open(path, "rb") as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
 
 
 if __name__ == "__main__":
@@ -13,13 +13,16 @@ def main():
     ap.add_argument("--render", action="store_true", help="Render DOT via graphviz 'dot'")
     ap.add_argument("--png", default="qpdg.png", help="PNG output path (if --render)")
     ap.add_argument("--no-edge-labels", action="store_true")
+    ap.add_argument("--group-by-time", action="store_true", help="Cluster nodes by time step (rank=same)")
+    ap.add_argument("--group-edges", action="store_true", help="Merge each node's same-kind edges into one statement")
     args = ap.parse_args()
 
     out = load_outjson(args.outjson)
     builder = QPDGBuilder()
     g = builder.build_from_outjson(out)
 
-    dot_path = write_dot(g, args.dot, show_edge_labels=not args.no_edge_labels)
+    dot_path = write_dot(g, args.dot, show_edge_labels=not args.no_edge_labels,
+                         group_by_time=args.group_by_time, group_edges=args.group_edges)
     print(f"Wrote DOT: {dot_path} (nodes={len(g.nodes)} edges={len(g.edges)})")
 
     if args.render:
@@ -1,52 +1,295 @@
 from __future__ import annotations
-from typing import Optional
+from collections import Counter, OrderedDict, defaultdict
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from pathlib import Path
+try:
+    import pygraphviz  # type: ignore[import-not-found]
+except ImportError:
+    pygraphviz = None
+try:
+    import igraph  # type: ignore[import-not-found]
+except ImportError:
+    igraph = None
 
-from qpdg_builder import QPDG
+from qpdg_builder import Edge, Node, NodeId, QPDG
+
+
+# Compact labels that still debug well, one formatter per node kind
+def _fmt_qop(n) -> str:
+    return "QOP\\n%s@t%s,l%s\\n%s:%s" % (n.qubit, n.time, n.line, n.action or "", n.gate or "")
+
+
+def _fmt_measure(n) -> str:
+    return "MEASURE\\n%s@t%s,l%s\\n-> %s" % (n.qubit, n.time, n.line, n.store)
+
+
+def _fmt_cdef(n) -> str:
+    return "CDEF\\n%s@t%s,l%s" % (n.store, n.time, n.line)
+
+
+def _fmt_default(n) -> str:
+    return "%s\\n%s" % (n.kind, n.id)
+
+
+_FMT = {"QOP": _fmt_qop, "MEASURE": _fmt_measure, "CDEF": _fmt_cdef}
+
+
+# Labels are quoted in DOT; only '"' needs escaping. Backslashes are left alone because
+# the formatters use DOT's own "\\n" line breaks.
+_ESCAPE = str.maketrans({'"': '\\"'})
+
+
+def _node_text(n) -> str:
+    """Label text for a node, unescaped."""
+    return _FMT.get(n.kind, _fmt_default)(n)
 
 
 def _node_label(n) -> str:
-    # Compact label that still debugs well
-    if n.kind == "QOP":
-        g = n.gate or ""
-        a = n.action or ""
-        return f"{n.kind}\\n{n.qubit}@t{n.time},l{n.line}\\n{a}:{g}"
-    if n.kind == "MEASURE":
-        return f"MEASURE\\n{n.qubit}@t{n.time},l{n.line}\\n-> {n.store}"
-    if n.kind == "CDEF":
-        return f"CDEF\\n{n.store}@t{n.time},l{n.line}"
-    return f"{n.kind}\\n{n.id}"
-
-
-def to_dot(g: QPDG, *, show_edge_labels: bool = True) -> str:
+    """DOT-ready (escaped) label for a node."""
+    label = _node_text(n)
+    # Names from out.json are identifiers, so the translate almost never runs
+    return label.translate(_ESCAPE) if '"' in label else label
+
+
+DOT_HEADER = 'digraph QPDG {\n  rankdir="LR";\n  node [shape=box, fontsize=10];\n'
+DOT_FOOTER = "}"
+
+
+# Files write_dot last produced, as path -> ((fingerprint, show_edge_labels, group_by_time,
+# group_edges), (mtime_ns, size)); a small LRU of keys only, no DOT text is kept. The
+# fingerprint is None when the graph had not been hashed yet (see write_dot)
+_WRITTEN: "OrderedDict[str, Tuple[Tuple[Optional[int], bool, bool, bool], Optional[Tuple[int, int]]]]" = OrderedDict()
+_WRITTEN_SIZE = 128
+
+
+def _lru_put(cache: OrderedDict, key, value, size: int) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > size:
+        cache.popitem(last=False)
+
+
+def to_dot(g: QPDG, *, show_edge_labels: bool = True, group_by_time: bool = False,
+           group_edges: bool = False) -> str:
+    return "".join(iter_dot(g, show_edge_labels=show_edge_labels, group_by_time=group_by_time,
+                            group_edges=group_edges))
+
+
+def iter_dot(g: QPDG, *, show_edge_labels: bool = True, group_by_time: bool = False,
+             group_edges: bool = False) -> Iterator[str]:
+    """
+    Yield the DOT text in pieces: header, one string per node and per edge, footer.
+
+    group_by_time puts the nodes of each time step in a `subgraph cluster_t<time>` with
+    rank=same, so each time step is drawn as one labelled column. This is a layout
+    choice, not a speedup: it adds one cluster per time step for dot to place. Nodes
+    without a time stay at the top level.
+
+    group_edges emits edges source by source (from the CSR view, see QPDG.freeze) and
+    merges each source's edges of one kind into `"a" -> {"b" "c"}`: smaller output, and
+    dot's parser works through one source node at a time.
+    """
     # Colors are optional; keep it simple
-    lines = []
-    lines.append("digraph QPDG {")
-    lines.append('  rankdir="LR";')
-    lines.append('  node [shape=box, fontsize=10];')
+    yield DOT_HEADER
+
+    # Node groups as (opening, indent, members, closing); a single unnamed group unless grouping
+    if group_by_time:
+        buckets: Dict[int, List[Tuple[str, Node]]] = defaultdict(list)
+        untimed: List[Tuple[str, Node]] = []
+        for item in g.nodes.items():
+            t = item[1].time
+            (untimed if t is None else buckets[t]).append(item)
+        groups: List[Tuple[str, str, Iterable[Tuple[str, Node]], str]] = [("", "  ", untimed, "")]
+        groups.extend(('  subgraph cluster_t%s {\n    rank=same;\n    label="t=%s";\n' % (t, t), "    ",
+                       buckets[t], "  }\n")
+                      for t in sorted(buckets))
+    else:
+        groups = [("", "  ", g.nodes.items(), "")]
+
+    # Nodes (label helper bound to a local; this loop runs once per node)
+    node_label = _node_label
+    for opening, indent, members, closing in groups:
+        if opening:
+            yield opening
+        for nid, n in members:
+            yield indent + '"' + nid + '" [label="' + node_label(n) + '"];\n'
+        if closing:
+            yield closing
+
+    # Edges (branch hoisted out of the loop)
+    if group_edges:
+        yield from _iter_grouped_edges(g, show_edge_labels)
+    elif show_edge_labels:
+        # A graph has only a handful of edge kinds; format each kind's suffix once
+        suffixes: Dict[str, str] = {}
+        for e in g.edges:
+            suffix = suffixes.get(e.kind)
+            if suffix is None:
+                suffix = suffixes[e.kind] = '" [label="' + e.kind + '"];\n'
+            yield '  "' + e.src + '" -> "' + e.dst + suffix
+    else:
+        for e in g.edges:
+            yield '  "' + e.src + '" -> "' + e.dst + '";\n'
+
+    yield DOT_FOOTER
+
+
+def _iter_grouped_edges(g: QPDG, show_edge_labels: bool) -> Iterator[str]:
+    csr = g.freeze()
+    ids, indptr, indices, kinds = csr.ids, csr.indptr, csr.indices, csr.kinds
+    if show_edge_labels:
+        suffixes = [' [label="' + k + '"];\n' for k in csr.kind_names]
+    for u in range(len(ids)):
+        start, end = indptr[u], indptr[u + 1]
+        if start == end:
+            continue
+        head = '  "' + ids[u] + '" -> '
+        # Destinations per kind (a single bucket without labels), in edge order
+        buckets: Dict[int, List[int]] = {}
+        for j in range(start, end):
+            buckets.setdefault(kinds[j] if show_edge_labels else 0, []).append(indices[j])
+        for k, dsts in buckets.items():
+            suffix = suffixes[k] if show_edge_labels else ";\n"
+            # A node listed twice in {...} is still one edge, so repeats get their own lines
+            unique = list(dict.fromkeys(dsts))
+            if len(unique) == 1:
+                yield head + '"' + ids[unique[0]] + '"' + suffix
+            else:
+                yield head + "{" + " ".join('"' + ids[v] + '"' for v in unique) + "}" + suffix
+            if len(unique) != len(dsts):
+                repeats = list(dsts)
+                for v in unique:
+                    repeats.remove(v)
+                for v in repeats:
+                    yield head + '"' + ids[v] + '"' + suffix
+
+
+class DotSnapshot(NamedTuple):
+    """A DOT file as write_dot_diff left it, for diffing the next version against."""
+    path: str                             # resolved path of the full DOT file
+    options: Tuple[bool, bool, bool]      # (show_edge_labels, group_by_time, group_edges)
+    stamp: Tuple[int, int]                # (st_mtime_ns, st_size) of that file after the write
+    fingerprint: int
+    labels: Dict[NodeId, str]             # node id -> escaped label
+    edges: "Counter[Edge]"
+
+
+class DotDiff(NamedTuple):
+    added_nodes: List[NodeId]
+    removed_nodes: List[NodeId]
+    relabeled_nodes: List[NodeId]
+    added_edges: "Counter[Edge]"
+    removed_edges: "Counter[Edge]"
+
+    def size(self) -> int:
+        return (len(self.added_nodes) + len(self.removed_nodes) + len(self.relabeled_nodes)
+                + sum(self.added_edges.values()) + sum(self.removed_edges.values()))
 
-    # Nodes
-    for nid, n in g.nodes.items():
-        label = _node_label(n).replace('"', '\\"')
-        lines.append(f'  "{nid}" [label="{label}"];')
 
-    # Edges
-    for e in g.edges:
-        if show_edge_labels:
-            lines.append(f'  "{e.src}" -> "{e.dst}" [label="{e.kind}"];')
-        else:
-            lines.append(f'  "{e.src}" -> "{e.dst}";')
+# write_dot_diff writes an overlay instead of the full file below this share of changed items
+DIFF_THRESHOLD = 0.05
 
-    lines.append("}")
-    return "\n".join(lines)
 
+def _file_stamp(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
-def write_dot(g: QPDG, out_path: str | Path, *, show_edge_labels: bool = True) -> Path:
+
+def diff_dot(prev: DotSnapshot, g: QPDG) -> DotDiff:
+    """What changed in g since the file prev describes."""
+    old = prev.labels
+    new = {nid: _node_label(n) for nid, n in g.nodes.items()}
+    edges = Counter(g.edges)
+    return DotDiff(
+        [nid for nid in new if nid not in old],
+        [nid for nid in old if nid not in new],
+        [nid for nid, label in new.items() if nid in old and old[nid] != label],
+        edges - prev.edges,
+        prev.edges - edges,
+    )
+
+
+def _iter_overlay(g: QPDG, diff: DotDiff, show_edge_labels: bool) -> Iterator[str]:
+    # Added/relabeled nodes and added edges as DOT; removals can only be listed as comments
+    yield DOT_HEADER.replace("digraph QPDG {", "digraph QPDG_diff {", 1)
+    for nid in diff.removed_nodes:
+        yield "  // removed node " + nid + "\n"
+    for (src, dst, kind), count in diff.removed_edges.items():
+        yield ("  // removed edge " + src + " -> " + dst + " [" + kind + "]\n") * count
+    for nid in chain(diff.added_nodes, diff.relabeled_nodes):
+        yield '  "' + nid + '" [label="' + _node_label(g.nodes[nid]) + '"];\n'
+    for (src, dst, kind), count in diff.added_edges.items():
+        suffix = '" [label="' + kind + '"];\n' if show_edge_labels else '";\n'
+        yield ('  "' + src + '" -> "' + dst + suffix) * count
+    yield DOT_FOOTER
+
+
+def write_dot(g: QPDG, out_path: str | Path, *, show_edge_labels: bool = True,
+              group_by_time: bool = False, group_edges: bool = False) -> Path:
+    """Write g as DOT to out_path and return out_path."""
     out_path = Path(out_path)
-    out_path.write_text(to_dot(g, show_edge_labels=show_edge_labels), encoding="utf-8")
+    key = str(out_path.resolve())
+    options = (show_edge_labels, group_by_time, group_edges)
+    # Skip the write when this file still holds what we last wrote for the same graph. Hashing
+    # the graph costs about as much as writing it, so only do it once this path was written
+    # before in this process (a single CLI run never is)
+    last = _WRITTEN.get(key)
+    if last is not None and last[0] == (g.fingerprint(), *options) and _file_stamp(out_path) == last[1]:
+        return out_path
+    # Streamed, so the whole DOT text is never held in memory
+    with open(out_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(iter_dot(g, show_edge_labels=show_edge_labels, group_by_time=group_by_time,
+                              group_edges=group_edges))
+    # Record the fingerprint only if the graph was already hashed; never compute it here
+    _lru_put(_WRITTEN, key, ((g.known_fingerprint, *options), _file_stamp(out_path)), _WRITTEN_SIZE)
     return out_path
 
 
+def write_dot_diff(g: QPDG, out_path: str | Path, prev: Optional[DotSnapshot] = None, *,
+                   show_edge_labels: bool = True, group_by_time: bool = False,
+                   group_edges: bool = False) -> Tuple[DotSnapshot, Optional[Path]]:
+    """
+    Differential write_dot for graphs that are rewritten often with small changes.
+
+    Returns (snapshot, overlay). snapshot describes the full DOT file at out_path; pass
+    it as prev on the next call. If prev still matches that file (same path and options,
+    and the file's mtime and size unchanged since prev was returned) then:
+      - if g shows the same as the file, nothing is written and overlay is None;
+      - if fewer than DIFF_THRESHOLD of the nodes and edges changed, only the changes
+        are written, to <out_path stem>.diff.dot, which is returned as overlay. The
+        full file is left alone, so snapshot is prev and the next overlay again holds
+        every change since that file was written.
+    Otherwise g is written in full to out_path (as by write_dot) and overlay is None.
+    A stale overlay file is removed whenever overlay is None.
+    """
+    out_path = Path(out_path)
+    key = str(out_path.resolve())
+    options = (show_edge_labels, group_by_time, group_edges)
+    overlay = out_path.with_name(out_path.stem + ".diff.dot")
+    if (prev is not None and prev.path == key and prev.options == options
+            and _file_stamp(out_path) == prev.stamp):
+        if prev.fingerprint == g.fingerprint():
+            overlay.unlink(missing_ok=True)
+            return prev, None
+        diff = diff_dot(prev, g)
+        if diff.size() < DIFF_THRESHOLD * (len(g.nodes) + len(g.edges)):
+            with open(overlay, "w", encoding="utf-8") as f:
+                f.writelines(_iter_overlay(g, diff, show_edge_labels))
+            return prev, overlay
+    write_dot(g, out_path, show_edge_labels=show_edge_labels, group_by_time=group_by_time,
+              group_edges=group_edges)
+    overlay.unlink(missing_ok=True)
+    stamp = _file_stamp(out_path)
+    assert stamp is not None  # just written
+    snapshot = DotSnapshot(key, options, stamp, g.fingerprint(),
+                           {nid: _node_label(n) for nid, n in g.nodes.items()}, Counter(g.edges))
+    return snapshot, None
+
+
 def render_with_graphviz(dot_path: str | Path, out_path: str | Path, fmt: str = "png") -> None:
     """
     Requires graphviz installed:
@@ -58,3 +301,148 @@ def render_with_graphviz(dot_path: str | Path, out_path: str | Path, fmt: str =
     out_path = str(out_path)
     subprocess.run(["dot", f"-T{fmt}", dot_path, "-o", out_path], check=True)
 
+
+def render_multi(dot_path: str | Path, out_dir: str | Path,
+                 formats: Iterable[str] = ("png", "svg")) -> List[Path]:
+    """
+    Render one DOT file in several formats at once, one `dot` process per format on a
+    thread pool (the threads only wait on the processes). Outputs are
+    out_dir/<dot stem>.<fmt>; returns them in the order of formats.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    dot_path = Path(dot_path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outputs = [(fmt, out_dir / f"{dot_path.stem}.{fmt}") for fmt in formats]
+    if not outputs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(outputs), os.cpu_count() or 1)) as ex:
+        list(ex.map(lambda item: render_with_graphviz(dot_path, item[1], fmt=item[0]), outputs))
+    return [out for _, out in outputs]
+
+
+def render_direct(g: QPDG, out_path: str | Path, fmt: str = "png", *,
+                  show_edge_labels: bool = True, group_by_time: bool = False,
+                  group_edges: bool = False) -> None:
+    """
+    Render g without a DOT file: iter_dot is streamed into `dot`'s stdin, so dot
+    parses while the text is still being generated. Requires graphviz (see above).
+    """
+    import io
+    import subprocess
+    args = ["dot", f"-T{fmt}", "-o", str(out_path)]
+    p = subprocess.Popen(args, stdin=subprocess.PIPE)
+    assert p.stdin is not None  # stdin=PIPE
+    try:
+        with io.TextIOWrapper(p.stdin, encoding="utf-8") as stdin:
+            stdin.writelines(iter_dot(g, show_edge_labels=show_edge_labels, group_by_time=group_by_time,
+                                      group_edges=group_edges))
+    except BrokenPipeError:
+        pass  # dot exited early; its return code says why
+    if p.wait() != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
+
+
+def render_in_process(g: QPDG, out_path: str | Path, fmt: str = "png", *,
+                      show_edge_labels: bool = True) -> None:
+    """
+    Lay out and render g through Graphviz's libraries via pygraphviz (optional),
+    building the graph from g.nodes/g.edges directly: no DOT text, no file, no `dot`
+    process. Without pygraphviz the DOT text is piped to `dot` instead.
+    """
+    if pygraphviz is None:
+        render_direct(g, out_path, fmt, show_edge_labels=show_edge_labels)
+        return
+    A = pygraphviz.AGraph(name="QPDG", directed=True, strict=False)
+    A.graph_attr["rankdir"] = "LR"
+    A.node_attr.update(shape="box", fontsize="10")
+    # pygraphviz quotes attribute values itself, so labels go in unescaped
+    for nid, n in g.nodes.items():
+        A.add_node(nid, label=_node_text(n))
+    if show_edge_labels:
+        for e in g.edges:
+            A.add_edge(e.src, e.dst, label=e.kind)
+    else:
+        for e in g.edges:
+            A.add_edge(e.src, e.dst)
+    A.layout(prog="dot")
+    A.draw(str(out_path), format=fmt)
+
+
+
+def render_via_igraph(g: QPDG, out_path: str | Path, layout: str = "sugiyama") -> None:
+    """
+    Lay out and draw g with python-igraph (optional; drawing needs pycairo), skipping
+    Graphviz entirely. Vertices are the CSR node indices from g.freeze() and all edges
+    are added in one bulk call. The default Sugiyama layout uses node times as layers
+    when every vertex has one. Without igraph this falls back to render_direct.
+    """
+    out_path = Path(out_path)
+    if igraph is None:
+        render_direct(g, out_path, out_path.suffix.lstrip(".") or "png")
+        return
+    csr = g.freeze()
+    ids, indptr, indices = csr.ids, csr.indptr, csr.indices
+    edge_list = [(u, indices[j]) for u in range(len(ids)) for j in range(indptr[u], indptr[u + 1])]
+    G = igraph.Graph(n=len(ids), edges=edge_list, directed=True)
+    nodes = g.nodes
+    G.vs["label"] = [_node_text(nodes[nid]).replace("\\n", "\n") if nid in nodes else nid
+                     for nid in ids]
+    if layout == "sugiyama":
+        times = [nodes[nid].time if nid in nodes else None for nid in ids]
+        coords = G.layout_sugiyama(layers=None if None in times else times)
+    else:
+        coords = G.layout(layout)
+    igraph.plot(G, target=str(out_path), layout=coords, vertex_shape="rectangle")
+
+
+def _arg_max() -> int:
+    import os
+    try:
+        limit = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        limit = -1
+    if limit <= 0:
+        limit = 32 * 1024  # Windows command lines are capped near 32K characters
+    # Leave room for the environment and the fixed arguments
+    return max(4096, min(limit // 2, 128 * 1024))
+
+
+def render_many_with_graphviz(dot_paths: Iterable[str | Path], fmt: str = "png",
+                              *, max_workers: int = 1) -> List[Path]:
+    """
+    Render many DOT files with as few `dot` processes as possible, using
+    `dot -T<fmt> -O a.dot b.dot ...`. Each output is written next to its input
+    as <input>.<fmt> (e.g. pass3.dot -> pass3.dot.png); returns those paths.
+
+    Files are split into chunks that fit on one command line; with max_workers > 1
+    the chunks run concurrently. Requires graphviz (see render_with_graphviz).
+    """
+    import subprocess
+    paths = [str(p) for p in dot_paths]
+    budget = _arg_max()
+    chunks: List[List[str]] = []
+    chunk: List[str] = []
+    size = 0
+    for p in paths:
+        cost = len(p.encode()) + 1
+        if chunk and size + cost > budget:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(p)
+        size += cost
+    if chunk:
+        chunks.append(chunk)
+
+    def run(chunk: List[str]) -> None:
+        subprocess.run(["dot", f"-T{fmt}", "-O", *chunk], check=True)
+
+    if max_workers > 1 and len(chunks) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as ex:
+            list(ex.map(run, chunks))
+    else:
+        for c in chunks:
+            run(c)
+    return [Path(f"{p}.{fmt}") for p in paths]